@@ -2,112 +2,157 @@ import argparse
 import pymupdf
 import os
 import hashlib
+import mmap
 import tiktoken
 from pathlib import Path
 import json
-import ast
+import re
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterator
 
 enc = tiktoken.get_encoding("cl100k_base")
 Dict_path = ".../data/processed"
 output_file_path =".../data/proceeded/output"
-
-def extract_pdf_stats(pdf_path):
-    with pymupdf.open(pdf_path) as doc:
-        num_pages=doc.page_count
-        print(f"Number of pages in the PDF: {num_pages}")
-        total_chars=sum(len(page.get_text()) for page in doc)
-        print(f"Number of total characters in a pdf: {total_chars}")
-        #File size in bytes
-        file_size_bytes = os.path.getsize(pdf_path)
-        print(f"File size in bytes: {file_size_bytes}")
-
-    return num_pages,total_chars,file_size_bytes
-
-#Calculate the text density,vowel ratio Newline ratio and flags for the pdf document
-def extract_text_from_pdf(pdf_path):
+VOWEL_BYTES = b"aeiouAEIOU"
+#Sentence end followed by the capital letter of the next sentence; linear-time for the stdlib re engine
+SENTENCE_END = re.compile(r"[.!?]\s+(?=[A-Z])")
+BOUNDARY_WINDOW = 32
+#Default text flags minus whitespace preservation: tabs/odd spaces become plain spaces, which chunking doesn't care about
+PAGE_TEXT_FLAGS = pymupdf.TEXTFLAGS_TEXT & ~pymupdf.TEXT_PRESERVE_WHITESPACE
+
+#Running counters for a pdf document, filled in by parse_pdf as the pages are read
+@dataclass
+class PdfStats:
+    num_pages: int = 0
+    total_chars: int = 0
+    total_vowels: int = 0
+    total_newlines: int = 0
+    file_size_bytes: int = 0
+
+#Method to open the pdf once and yield (page_num, page_text), updating the stats for every page on the way
+def parse_pdf(pdf_path, stats: PdfStats) -> Iterator[tuple[int, str]]:
+    stats.file_size_bytes = os.path.getsize(pdf_path)
     with pymupdf.open(pdf_path) as doc:
-        full_text = ""
-        for page in doc:
-            full_text += page.get_text()
-        
-        num_chars = len(full_text)
-        num_vowels = sum(full_text.count(vowel) for vowel in "aeiouAEIOU")
-        num_newlines = full_text.count("\n")
-        flags=[]
-        file_size_bytes = os.path.getsize(pdf_path)
-        chars_per_kb = num_chars / (file_size_bytes / 1024)
-        if chars_per_kb<10:
-            flags.append("NEEDS OCR")
-        vowel_ratio = num_vowels / num_chars if num_chars > 0 else 0
-        if vowel_ratio<0.25 or vowel_ratio>0.45:
-            flags.append("LOW_QUALITY_TEXT")
-        newline_ratio = num_newlines / num_chars if num_chars > 0 else 0
-        if newline_ratio>0.20:
-            flags.append("POSSIBLE_TABLE_LAYOUT_ISSUE")
-        
-        print(f"Text Density: {chars_per_kb:.4f}")
-        print(f"Vowel Ratio: {vowel_ratio:.4f}")
-        print(f"Newline Ratio: {newline_ratio:.4f}")
-        print(flags)
+        stats.num_pages = doc.page_count
+        for page_num, page in enumerate(doc):
+            page_text = page.get_text(flags=PAGE_TEXT_FLAGS)
+            stats.total_chars += len(page_text)
+            #UTF-8 keeps ASCII bytes as-is and never uses them inside multi-byte sequences,
+            #so deleting the vowel bytes in one C-level pass gives the exact vowel count
+            page_bytes = page_text.encode("utf-8")
+            stats.total_vowels += len(page_bytes) - len(page_bytes.translate(None, VOWEL_BYTES))
+            stats.total_newlines += page_bytes.count(b"\n")
+            yield (page_num + 1, page_text)
+
+#Calculate the text density,vowel ratio Newline ratio and flags for the pdf document from the accumulated stats
+def report_pdf_stats(stats: PdfStats) -> list[str]:
+    print(f"Number of pages in the PDF: {stats.num_pages}")
+    print(f"Number of total characters in a pdf: {stats.total_chars}")
+    print(f"File size in bytes: {stats.file_size_bytes}")
+
+    num_chars = stats.total_chars
+    flags=[]
+    chars_per_kb = num_chars / (stats.file_size_bytes / 1024)
+    if chars_per_kb<10:
+        flags.append("NEEDS OCR")
+    vowel_ratio = stats.total_vowels / num_chars if num_chars > 0 else 0
+    if vowel_ratio<0.25 or vowel_ratio>0.45:
+        flags.append("LOW_QUALITY_TEXT")
+    newline_ratio = stats.total_newlines / num_chars if num_chars > 0 else 0
+    if newline_ratio>0.20:
+        flags.append("POSSIBLE_TABLE_LAYOUT_ISSUE")
+
+    print(f"Text Density: {chars_per_kb:.4f}")
+    print(f"Vowel Ratio: {vowel_ratio:.4f}")
+    print(f"Newline Ratio: {newline_ratio:.4f}")
+    print(flags)
+    return flags
 
 #Method to get the document Id based on the file path and its size from SHA256 hash 
+#hashlib.file_digest (Python 3.11+) hashes in a C loop; older Pythons hash an mmap of the file in one update call
 def compute_document_id(pdf_path):
-    sha256_hash = hashlib.sha256() 
     with open(pdf_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)          
-    return sha256_hash.hexdigest()
-
-#Method to iterate through the pdf document and extract the texts which returns the page number and page text as a listt of tuples
-def iter_pages(pdf_path):
-    with pymupdf.open(pdf_path) as doc:
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            yield (page_num + 1, page.get_text())
-           
-
-#Method to print the token count for each page in the pdf document using tiktoken library
-def estimate_tokens(page_num: int, text: str) -> int:
-    token_count = len(enc.encode(text))
-    #print(f"Page {page_num} has approximately {token_count} tokens.")
-    return token_count
-
-#Method for writing the chunks into individual dictionaries
-def chunks_from_tokens(page_text,max_tokens=512):
-    tokens = enc.encode(page_text)
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+#Method to encode all the page texts in one tiktoken call, the BPE runs in parallel Rust threads outside the GIL
+def encode_pages(page_texts: list[str]) -> list[list[int]]:
+    return enc.encode_ordinary_batch(page_texts, num_threads=os.cpu_count() or 1)
+
+#Method to find the token indices where a new sentence starts (the first token after the . ! or ?)
+def sentence_starts(tokens: list[int]) -> list[int]:
+    text, offsets = enc.decode_with_offsets(tokens)
+    return [bisect_left(offsets, m.start() + 1) for m in SENTENCE_END.finditer(text)]
+
+#Method for splitting a page's precomputed tokens into chunks of at most max_tokens tokens
+#A chunk ends at the last sentence start within the final BOUNDARY_WINDOW tokens so sentences aren't cut in half
+def chunks_from_tokens(tokens: list[int], max_tokens=512) -> list[list[int]]:
+    starts = sentence_starts(tokens) if len(tokens) > max_tokens else []
     chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunk_tokens = tokens[i:i + max_tokens]
-        chunk_text = enc.decode(chunk_tokens)
-        chunks.append(chunk_text)
+    i = 0
+    while i < len(tokens):
+        end = min(i + max_tokens, len(tokens))
+        if end < len(tokens):
+            j = bisect_right(starts, end) - 1
+            if j >= 0 and starts[j] > max(i, end - BOUNDARY_WINDOW):
+                end = starts[j]
+        chunks.append(tokens[i:end])
+        i = end
     return chunks
 
+#Method to decode every chunk of the document back to text in one tiktoken call
+def decode_chunks(chunk_tokens: list[list[int]]) -> list[str]:
+    return enc.decode_batch(chunk_tokens, num_threads=os.cpu_count() or 1)
+
+
 
 
 
+#Method to build the chunk dictionaries for one page and store each of them, ids start at start_chunk_id
+def process_page(document_id: str, page_num: int, chunk_texts: list[str], start_chunk_id: int) -> list[dict]:
+    page_chunk_dicts = []
+    for chunk_id, chunk_text in enumerate(chunk_texts, start_chunk_id):
+        chunk_dict={}
+        chunk_dict["document_id"]=document_id
+        chunk_dict["chunk_id"] = f"{document_id}_{chunk_id:05d}"
+        chunk_dict["page_num"]=page_num
+        chunk_dict["chunk_text"]=chunk_text
+        store_dict_to_path(chunk_dict)
+        page_chunk_dicts.append(chunk_dict)
+    return page_chunk_dicts
 
 #Method to store the chunk dictionary to a json file , one chunk dictionary per line in the file
+#json.dumps escapes newlines inside strings, so each file is exactly one JSON line ending in "\n"
 def store_dict_to_path(chunk_dict):
     os.makedirs(Dict_path, exist_ok=True)
     file_path = os.path.join(Dict_path, f"{chunk_dict['chunk_id']}.json")
-    with open(file_path, "w") as f:
-        json.dump(chunk_dict, f, ensure_ascii=False)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(chunk_dict, ensure_ascii=False) + "\n")
 
 
 #Method to write all the chunks into a single json files
+#The per-chunk files are already single-line JSON, so their bytes are copied as-is without re-parsing
+#os.scandir lists names straight from readdir, so only the name strings are sorted (no Path or stat per entry)
 
 def save_chunks_json(Dict_path:str,output_file_path:str):
-    in_dir=Path(Dict_path)
     out_path=Path(output_file_path)
-    with out_path.open("w", encoding="utf-8") as out:
-        for p in sorted(in_dir.glob("*.json")):
-            with p.open("r", encoding="utf-8") as f:
-                try:
-                    obj = json.load(f)
-                except json.JSONDecodeError:
-                    f.seek(0)
-                    obj = ast.literal_eval(f.read())
-            out.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    with os.scandir(Dict_path) as entries:
+        names = sorted(e.name for e in entries if e.name.endswith(".json"))
+    with out_path.open("wb") as out:
+        for name in names:
+            with open(os.path.join(Dict_path, name), "rb") as f:
+                data = f.read()
+            out.write(data)
+            #Files written before store_dict_to_path added the trailing newline
+            if not data.endswith(b"\n"):
+                out.write(b"\n")
 
 
     
@@ -121,36 +166,45 @@ if __name__ == "__main__":
     if not args.pdf_path:
         parser.error("the following arguments are required: --pdf_path or pdf_path")
     
-    extract_pdf_stats(args.pdf_path)
-    extract_text_from_pdf(args.pdf_path)
     document_id = compute_document_id(args.pdf_path)
     print(f"Document ID: {document_id}")
     #chunking logic
     chunks=[]
     chunk_id=1
-    for page_num,page_text in iter_pages(args.pdf_path):
+    stats = PdfStats()
+    pages = []
+    for page_num,page_text in parse_pdf(args.pdf_path, stats):
         text_len = len(page_text.strip())
       
         if text_len <50:
             print(f"Skipping page {page_num} which has only {text_len} characters.")  
             continue
-        token_count = estimate_tokens(page_num, page_text)
-        print(f"Page {page_num} has {text_len} chars (~{token_count} tokens)")
-        #Creating a chunking dictionary to store the chunk information for each page 
-        page_chunks = chunks_from_tokens(page_text)
-        print(f"Page {page_num} → {len(page_chunks)} chunks")
-        for chunk_texts in page_chunks:
-            chunk_dict={}
-            chunk_dict["document_id"]=document_id
-            chunk_dict["chunk_id"] = f"{document_id}_{chunk_id:05d}"
-            chunk_dict["page_num"]=page_num
-            chunk_dict["chunk_text"]=chunk_texts
-            chunks.append(chunk_dict)
-            chunk_id+=1
-            #print the output of the chunk dictionary for the first 5 chunks
-            if len(chunks)<=5:
-                print(chunk_dict)
-            store_dict_to_path(chunk_dict)
+        pages.append((page_num, page_text, text_len))
+
+    #Encode every page at once, then slice and decode the chunks in batch as well
+    page_tokens = encode_pages([page_text for _, page_text, _ in pages])
+    page_chunk_tokens = []
+    for (page_num, _, text_len), tokens in zip(pages, page_tokens):
+        print(f"Page {page_num} has {text_len} chars (~{len(tokens)} tokens)")
+        page_chunk_tokens.append(chunks_from_tokens(tokens))
+        print(f"Page {page_num} → {len(page_chunk_tokens[-1])} chunks")
+    chunk_texts_iter = iter(decode_chunks([c for page_chunks in page_chunk_tokens for c in page_chunks]))
+
+    #Chunk ids are sequential across the document, so every page gets its id range up front
+    page_jobs = []
+    for (page_num, _, _), page_chunks in zip(pages, page_chunk_tokens):
+        page_jobs.append((document_id, page_num, list(islice(chunk_texts_iter, len(page_chunks))), chunk_id))
+        chunk_id += len(page_chunks)
+
+    #Pages are independent now, so their chunk files are written in parallel (file writes release the GIL)
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+        for page_chunk_dicts in pool.map(lambda job: process_page(*job), page_jobs):
+            chunks.extend(page_chunk_dicts)
+
+    #print the output of the chunk dictionary for the first 5 chunks
+    for chunk_dict in chunks[:5]:
+        print(chunk_dict)
+    report_pdf_stats(stats)
     print(f"Total chunks created: {len(chunks)}")
     save_chunks_json(Dict_path=Dict_path, output_file_path="/Users/anuraggupta/projects/sentinel-rag/data/processed/output/combined.jsonl")
 
@@ -1,16 +1,25 @@
-import json
+import logging
 import os
-from typing import List, Dict, Any
+import string
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
 
 import boto3
 import botocore
+import orjson
 import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
 from requests_aws4auth import AWS4Auth
 
 from dotenv import load_dotenv
 load_dotenv()
+from app.hot_cache import HotCache
 import time
-from typing import Generator
+from typing import Generator, Iterator
+
+logger = logging.getLogger(__name__)
 
 # ---------- ENV HELPERS ----------
 
@@ -27,40 +36,62 @@ def _make_awsauth(region: str, service: str = "aoss") -> AWS4Auth:
     if creds is None:
         raise RuntimeError("No AWS credentials found")
 
-    frozen = creds.get_frozen_credentials()
+    # Refreshable credentials let one long-lived signer survive STS/role credential rotation.
+    return AWS4Auth(refreshable_credentials=creds, region=region, service=service)
+
+
+# ---------- SHARED CLIENTS ----------
 
-    return AWS4Auth(
-        frozen.access_key,
-        frozen.secret_key,
-        region,
-        service,
-        session_token=frozen.token,
+# Built lazily once per region and reused by every request, so the hot path skips
+# client construction and credential resolution, and keeps TLS connections alive.
+
+@lru_cache(maxsize=None)
+def _bedrock_client(region: str):
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(max_pool_connections=50, retries={"mode": "adaptive"}),
     )
 
 
+@lru_cache(maxsize=None)
+def _opensearch_session(region: str) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = _make_awsauth(region)
+    return session
+
+
 # ---------- EMBEDDING ----------
 
+# Log query-embedding cache hit/miss counts every N lookups.
+_QUERY_CACHE_LOG_EVERY = 100
 
-def embed_text(text: str) -> List[float]:
+# Titan v2 output size (256, 512 or 1024); must match the index's knn_vector dimension.
+_EMBED_DIM = int(os.getenv("EMBED_DIM", "1024"))
+
+
+def _invoke_embedding(model_id: str, dims: int, normalize: bool, text: str) -> List[float]:
     region = os.getenv("AWS_REGION", "us-east-1")
-    model_id = os.getenv("BEDROCK_MODEL_ID", "amazon.titan-embed-text-v2:0")
 
-    client = boto3.client("bedrock-runtime", region_name=region)
+    client = _bedrock_client(region)
 
     payload = {
         "inputText": text,
-        "dimensions": 1024,
-        "normalize": True,
+        "dimensions": dims,
+        "normalize": normalize,
     }
 
     resp = client.invoke_model(
         modelId=model_id,
         contentType="application/json",
         accept="application/json",
-        body=json.dumps(payload),
+        body=orjson.dumps(payload),
     )
 
-    body = json.loads(resp["body"].read())
+    body = orjson.loads(resp["body"].read())
 
     if "embedding" not in body:
         raise RuntimeError(f"Unexpected embedding response: {body}")
@@ -68,22 +99,67 @@ def embed_text(text: str) -> List[float]:
     emb = body["embedding"]
     if not isinstance(emb, list):
         raise RuntimeError(f"Embedding is not a list: {type(emb)}")
-    if len(emb) != 1024:
-        raise RuntimeError(f"Embedding dimension {len(emb)} != 1024 (expected 1024)")
+    if len(emb) != dims:
+        raise RuntimeError(f"Embedding dimension {len(emb)} != {dims} (expected {dims})")
 
     return emb
 
 
+@lru_cache(maxsize=4096)
+def _embed_cached(model_id: str, dims: int, normalize: bool, text: str) -> Tuple[float, ...]:
+    # Stored as a tuple so callers can't mutate the cached vector.
+    return tuple(_invoke_embedding(model_id, dims, normalize, text))
+
+
+def embed_text(text: str) -> List[float]:
+    model_id = os.getenv("BEDROCK_MODEL_ID", "amazon.titan-embed-text-v2:0")
+    text = text.strip()
+
+    if os.getenv("RAG_QUERY_CACHE", "1") != "1":
+        return _invoke_embedding(model_id, _EMBED_DIM, True, text)
+
+    emb = _embed_cached(model_id, _EMBED_DIM, True, text)
+
+    info = _embed_cached.cache_info()
+    if (info.hits + info.misses) % _QUERY_CACHE_LOG_EVERY == 0:
+        logger.info(
+            "query embedding cache: hits=%d misses=%d size=%d",
+            info.hits, info.misses, info.currsize,
+        )
+
+    return list(emb)
+
+
 # ---------- RETRIEVAL ----------
 
+# Recent retrievals, reused when a new query vector is (nearly) identical to a cached one.
+# Opt-in (RAG_HOT_CACHE=1): entries aren't invalidated on reindex, so they can be stale
+# for up to RAG_HOT_CACHE_TTL_S.
+_HOT_CACHE = (
+    HotCache(
+        capacity=int(os.getenv("RAG_HOT_CACHE_SIZE", "4096")),
+        dim=_EMBED_DIM,
+        min_similarity=float(os.getenv("RAG_HOT_CACHE_MIN_SIM", "0.99")),
+        ttl_s=float(os.getenv("RAG_HOT_CACHE_TTL_S", "3600")),
+    )
+    if os.getenv("RAG_HOT_CACHE", "0") == "1"
+    else None
+)
+
+
 def retrieve_chunks(query_vector: List[float], k: int = 5) -> List[Dict[str, Any]]:
+    if _HOT_CACHE is not None:
+        cached = _HOT_CACHE.lookup(query_vector, k)
+        if cached is not None:
+            return cached
+
     endpoint = _require_env("OPENSEARCH_END_POINT")
     index = _require_env("INDEX_NAME")
     region = os.getenv("AWS_REGION", "us-east-1")
 
     url = f"{endpoint.rstrip('/')}/{index}/_search"
 
-    awsauth = _make_awsauth(region)
+    session = _opensearch_session(region)
 
     query = {
         "size": k,
@@ -98,38 +174,30 @@ def retrieve_chunks(query_vector: List[float], k: int = 5) -> List[Dict[str, Any
         },
     }
 
-    r = requests.post(url, auth=awsauth, json=query, timeout=60)
+    r = session.post(
+        url,
+        data=orjson.dumps(query),
+        headers={"Content-Type": "application/json"},
+        timeout=60,
+    )
 
     if r.status_code >= 300:
         raise RuntimeError(f"OpenSearch error {r.status_code}: {r.text}")
 
-    result = r.json()
-
-    return result.get("hits", {}).get("hits", [])
-
+    result = orjson.loads(r.content)
 
-# ---------- GENERATION (CLAUDE) ----------
+    hits = result.get("hits", {}).get("hits", [])
 
-def generate_answer(question: str, chunks: List[Dict[str, Any]]) -> str:
-    region = os.getenv("AWS_REGION", "us-east-1")
-    model_id = os.getenv(
-        "BEDROCK_LLM_MODEL_ID",
-        "anthropic.claude-3-sonnet-20240229-v1:0"
-    )
+    if _HOT_CACHE is not None:
+        _HOT_CACHE.put(query_vector, k, hits)
 
-    client = boto3.client("bedrock-runtime", region_name=region)
+    return hits
 
-    context_parts = []
-    for h in chunks:
-        src = h.get("_source", {})
-        page = src.get("page_num")
-        chunk_id = src.get("chunk_id")
-        text = src.get("chunk_text", "")
-        context_parts.append(f"(p.{page}, {chunk_id})\n{text}")
 
-    context = "\n\n".join(context_parts)
+# ---------- GENERATION (CLAUDE) ----------
 
-    prompt = f"""
+# Claude prompt, specialized at import; only $context and $question are filled in per request.
+_PROMPT_TMPL = string.Template("""
 You are a helpful assistant.
 Answer the QUESTION using ONLY the CONTEXT below.
 If the answer is not in the context, say exactly:
@@ -141,46 +209,111 @@ Do not invent page numbers or chunk_ids.
 After EACH bullet, add citations in this exact format: (p.<page>, <chunk_id>)
 
 CONTEXT:
-{context}
+$context
 
 QUESTION:
-{question}
+$question
 
 ANSWER:
-"""
+""")
+
+
+def _build_context(chunks: List[Dict[str, Any]]) -> str:
+    context_parts = []
+    for h in chunks:
+        src = h.get("_source", {})
+        page = src.get("page_num")
+        chunk_id = src.get("chunk_id")
+        text = src.get("chunk_text", "")
+        context_parts.append(f"(p.{page}, {chunk_id})\n{text}")
+
+    return "\n\n".join(context_parts)
 
-    body = {
+
+def _claude_body(prompt: str) -> bytes:
+    return orjson.dumps({
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 800,
         "temperature": 0,
         "messages": [
-            {
-                "role": "user",
-                "content": prompt,
-            }
+            {"role": "user", "content": prompt}
         ],
-    }
+    })
 
-    resp = client.invoke_model(
+
+def generate_answer_stream(question: str, chunks: List[Dict[str, Any]]) -> Iterator[str]:
+    region = os.getenv("AWS_REGION", "us-east-1")
+    model_id = os.getenv(
+        "BEDROCK_LLM_MODEL_ID",
+        "anthropic.claude-3-sonnet-20240229-v1:0"
+    )
+
+    client = _bedrock_client(region)
+
+    prompt = _PROMPT_TMPL.substitute(context=_build_context(chunks), question=question)
+
+    #Method which invokes model to stream with a response stream 
+    response = client.invoke_model_with_response_stream(
         modelId=model_id,
+        body=_claude_body(prompt),
         contentType="application/json",
         accept="application/json",
-        body=json.dumps(body),
     )
 
-    response_body = json.loads(resp["body"].read())
+    # Stream tokens
+    for event in response["body"]:
+        chunk = orjson.loads(event["chunk"]["bytes"])
 
-    return response_body["content"][0]["text"]
+        if chunk["type"] == "content_block_delta":
+            delta = chunk["delta"].get("text")
+            if delta:
+                yield delta
+
+
+def generate_answer(question: str, chunks: List[Dict[str, Any]]) -> str:
+    return "".join(generate_answer_stream(question, chunks))
 
 
 
 
 # ---------- FULL RAG PIPELINE ----------
 
+# Used to warm the OpenSearch connection while the query embedding is in flight.
+_WARMUP_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-warmup")
+_opensearch_warm = False
+
+
+def _warm_opensearch() -> None:
+    global _opensearch_warm
+
+    endpoint = _require_env("OPENSEARCH_END_POINT")
+    index = _require_env("INDEX_NAME")
+    region = os.getenv("AWS_REGION", "us-east-1")
+
+    try:
+        _opensearch_session(region).head(f"{endpoint.rstrip('/')}/{index}", timeout=10)
+    except requests.RequestException as e:
+        # Best effort: retrieve_chunks reports real connectivity errors.
+        logger.debug("OpenSearch warm-up failed: %s", e)
+    _opensearch_warm = True
+
+
+def _embed_with_warmup(question: str) -> List[float]:
+    # On a cold process, open the SigV4-signed OpenSearch connection (TCP + TLS)
+    # concurrently with the Bedrock embedding call instead of after it.
+    if _opensearch_warm:
+        return embed_text(question)
+
+    warmup = _WARMUP_POOL.submit(_warm_opensearch)
+    query_vector = embed_text(question)
+    warmup.result()
+    return query_vector
+
+
 def ask_rag(question: str) -> Dict[str, Any]:
     t0 = time.time()
 
-    query_vector = embed_text(question)
+    query_vector = _embed_with_warmup(question)
     chunks = retrieve_chunks(query_vector, k=5)
     answer = generate_answer(question, chunks)
 
@@ -216,72 +349,13 @@ def ask_rag_stream(question: str) -> Generator[str, None, None]:
     start_time = time.time()
 
     # 1) Embed
-    query_vector = embed_text(question)
+    query_vector = _embed_with_warmup(question)
 
     # 2) Retrieve
     chunks = retrieve_chunks(query_vector, k=5)
 
-    # Build context
-    context_parts = []
-    for h in chunks:
-        src = h.get("_source", {})
-        page = src.get("page_num")
-        chunk_id = src.get("chunk_id")
-        text = src.get("chunk_text", "")
-        context_parts.append(f"(p.{page}, {chunk_id})\n{text}")
-
-    context = "\n\n".join(context_parts)
-
-    prompt = f"""
-You are a helpful assistant.
-Answer the QUESTION using ONLY the CONTEXT below.
-If the answer is not in the context, say exactly:
-I can’t find that in the provided document.
-
-Return your answer as bullet points.
-After EACH bullet, add citations in this exact format: (p.<page>, <chunk_id>)
-
-CONTEXT:
-{context}
-
-QUESTION:
-{question}
-
-ANSWER:
-"""
-
-    region = os.getenv("AWS_REGION", "us-east-1")
-    model_id = os.getenv(
-        "BEDROCK_LLM_MODEL_ID",
-        "anthropic.claude-3-sonnet-20240229-v1:0"
-    )
-
-    client = boto3.client("bedrock-runtime", region_name=region)
-
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 800,
-        "temperature": 0,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-    }
-    #Method which invokes model to stream with a response stream 
-    response = client.invoke_model_with_response_stream(
-        modelId=model_id,
-        body=json.dumps(body),
-        contentType="application/json",
-        accept="application/json",
-    )
-
-    # Stream tokens
-    for event in response["body"]:
-        chunk = json.loads(event["chunk"]["bytes"])
-
-        if chunk["type"] == "content_block_delta":
-            delta = chunk["delta"].get("text")
-            if delta:
-                yield delta
+    # 3) Generate
+    yield from generate_answer_stream(question, chunks)
 
     # Final metadata
     latency_ms = int((time.time() - start_time) * 1000)
@@ -1,10 +1,28 @@
 import boto3
 import json
+import orjson
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from botocore.config import Config
+
 INPUT_PATH = Path("/Users/anuraggupta/projects/sentinel-rag/data/processed/output/combined.jsonl")
 
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
+# Embedding is network-bound, so run several invoke_model calls in flight at once.
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "16"))
+BATCH_SIZE = EMBED_WORKERS * 4
+
+# One client shared by all workers (boto3 clients are thread-safe).
+# Adaptive retries back off on ThrottlingException when we hit the TPS quota.
+client = boto3.client(
+    "bedrock-runtime",
+    region_name="us-east-1",
+    config=Config(
+        max_pool_connections=EMBED_WORKERS,
+        retries={"mode": "adaptive", "total_max_attempts": 10},
+    ),
+)
 model_id = "amazon.titan-embed-text-v2:0"
 
 def embed_text(text: str) -> list[float]:
@@ -25,23 +43,34 @@ def embed_text(text: str) -> list[float]:
     model_response = json.loads(response["body"].read())
     return model_response["embedding"]
 
+def embed_batch(pool: ThreadPoolExecutor, batch: list[tuple[int, str]]):
+    embeddings = pool.map(embed_text, [chunk_text for _, chunk_text in batch])
+    for (line_num, _), embedding in zip(batch, embeddings):
+        if len(embedding) != 512:
+            raise ValueError(f"Unexpected embedding dimension {len(embedding)} on line {line_num}; expected 512")
+        print(f"Line {line_num}: embedding length {len(embedding)}")
+        print(f"Line {line_num}: embedding values: {embedding[:10]}")
+
 def process_jsonl(path: Path):
-    with path.open("r", encoding="utf-8") as f:
+    batch = []
+    # Read bytes with a 1 MiB buffer and hand them straight to orjson (no decode to str).
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool, path.open("rb", buffering=1 << 20) as f:
         for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
+            if not line.strip():
                 continue
-            obj = json.loads(line)
+            obj = orjson.loads(line)
             chunk_text = obj.get("chunk_text")
             if not chunk_text:
                 print(f"Skipping line {line_num}: missing chunk_text")
                 continue
 
-            embedding = embed_text(chunk_text)
-            if len(embedding) != 512:
-                raise ValueError(f"Unexpected embedding dimension {len(embedding)} on line {line_num}; expected 768")
-            print(f"Line {line_num}: embedding length {len(embedding)}")
-            print(f"Line {line_num}: embedding values: {embedding[:10]}")
+            batch.append((line_num, chunk_text))
+            if len(batch) >= BATCH_SIZE:
+                embed_batch(pool, batch)
+                batch = []
+
+        if batch:
+            embed_batch(pool, batch)
            
 
 process_jsonl(INPUT_PATH)
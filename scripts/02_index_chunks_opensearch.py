@@ -1,25 +1,96 @@
 #Script to generate the embeddings at run time
 #Importing the necessary packages
+import hashlib
 import json
 import os
+import sqlite3
+import time
 import boto3
+import orjson
 import requests
+from array import array
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from requests_aws4auth import AWS4Auth
 from pathlib import Path
 from dotenv import load_dotenv
 
+#Load the .env environment variables before the settings below read them.
+load_dotenv()
+
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 
 model_id = "amazon.titan-embed-text-v2:0"
 
+# Titan v2 output size (256, 512 or 1024); must match the index's knn_vector dimension.
+EMBED_DIM = int(os.environ.get("EMBED_DIM", "1024"))
+
+# Embedding is network-bound, so keep several invoke_model calls in flight.
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", "16"))
+
+# Embeddings already paid for are kept on disk, so re-runs (or a new index) skip Bedrock for known chunks.
+EMBED_CACHE_PATH = Path(os.environ.get("EMBED_CACHE_PATH", REPO_ROOT / "data" / "cache" / "embeddings.sqlite"))
+
+# _bulk requests are flushed at BULK_MAX_DOCS documents or BULK_MAX_BYTES, whichever comes first.
+BULK_MAX_DOCS = 200
+BULK_MAX_BYTES = 5 * 1024 * 1024
+BULK_MAX_RETRIES = 5
+# No _id in the action line: AOSS can reject custom IDs.
+BULK_ACTION = b'{"index":{}}\n'
+
+
+@lru_cache(maxsize=None)
+def bedrock_client(region: str):
+    """One bedrock-runtime client shared by all embedding workers (boto3 clients are thread-safe).
+    Adaptive retries back off on ThrottlingException when the workers hit the TPS quota."""
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(
+            max_pool_connections=EMBED_WORKERS,
+            retries={"mode": "adaptive", "total_max_attempts": 10},
+        ),
+    )
+
+
+class EmbeddingCache:
+    """SQLite cache of embeddings keyed by sha256(model_id|dim|text), stored as float32 blobs.
+    Only used from the main thread; embedding workers just call Bedrock."""
+
+    def __init__(self, path: Path, dim: int = EMBED_DIM):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{model_id}|{self.dim}|{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> list[float] | None:
+        row = self.conn.execute("SELECT vec FROM emb WHERE key = ?", (self.key(text),)).fetchone()
+        if row is None:
+            return None
+        return array("f", row[0]).tolist()
+
+    def put_many(self, items: list[tuple[str, list[float]]]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)",
+            [(self.key(text), array("f", vec).tobytes()) for text, vec in items],
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
 
 def get_bedrock_embedding(text: str, region: str) -> list[float]:
 
-    client = boto3.client("bedrock-runtime", region_name=region)
+    client = bedrock_client(region)
     body = {
         "inputText": text,
-        "dimensions": 1024,
+        "dimensions": EMBED_DIM,
         "normalize": True,
     }
     resp = client.invoke_model(
@@ -37,12 +108,11 @@ def get_bedrock_embedding(text: str, region: str) -> list[float]:
 #Reading the first chunk
 
 def iter_chunks(jsonl_path: str):
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            yield json.loads(line)
+    # Stay in bytes with a 1 MiB read buffer; orjson parses bytes directly and ignores the trailing newline.
+    with open(jsonl_path, "rb", buffering=1 << 20) as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 def make_awsauth(region: str, service: str = "aoss") -> AWS4Auth:
     """Creates SigV4 auth for OpenSearch Serverless (service = aoss)."""
@@ -58,46 +128,100 @@ def make_awsauth(region: str, service: str = "aoss") -> AWS4Auth:
     )
 
 
-def chunk_exists(endpoint: str, region: str, index_name: str, chunk_id: str) -> bool:
-    """Return True if a document with this chunk_id already exists in the index."""
+def load_indexed_chunk_ids(endpoint: str, region: str, index_name: str) -> set[str]:
+    """Return every chunk_id already in the index, fetched once up front instead of one _search per chunk.
+    Pages with search_after on chunk_id (keyword) since AOSS has no scroll API."""
     auth = make_awsauth(region=region, service="aoss")
     headers = {"Content-Type": "application/json"}
 
     search_url = f"{endpoint.rstrip('/')}/{index_name}/_search"
     query = {
-        "size": 0,
-        "query": {
-            "term": {
-                "chunk_id": chunk_id
-            }
-        }
+        "size": 1000,
+        "_source": ["chunk_id"],
+        "sort": [{"chunk_id": "asc"}],
+        "query": {"match_all": {}},
     }
 
-    resp = requests.post(search_url, auth=auth, headers=headers, data=json.dumps(query))
-    if resp.status_code != 200:
-        raise SystemExit(f"Failed to search for {chunk_id}: {resp.status_code} {resp.text}")
-
-    data = resp.json()
-    total = data.get("hits", {}).get("total", {})
-    # OpenSearch can return total as an int or an object
-    if isinstance(total, int):
-        return total > 0
-    return total.get("value", 0) > 0
-
-
-def index_one_doc(endpoint: str, region: str, index_name: str, doc: dict) -> requests.Response:
-    """POST a document into OpenSearch Serverless. (Do NOT set _id; AOSS can reject custom IDs.)"""
-    auth = make_awsauth(region=region, service="aoss")
-    headers = {"Content-Type": "application/json"}
-
-    url = f"{endpoint.rstrip('/')}/{index_name}/_doc"
-    return requests.post(url, auth=auth, headers=headers, data=json.dumps(doc, ensure_ascii=False))
+    seen = set()
+    while True:
+        resp = requests.post(search_url, auth=auth, headers=headers, data=json.dumps(query))
+        if resp.status_code != 200:
+            raise SystemExit(f"Failed to list indexed chunk_ids: {resp.status_code} {resp.text}")
+
+        hits = resp.json().get("hits", {}).get("hits", [])
+        seen.update(h["_source"]["chunk_id"] for h in hits)
+        if len(hits) < query["size"]:
+            return seen
+        query["search_after"] = hits[-1]["sort"]
+
+
+def send_bulk(endpoint: str, region: str, index_name: str, lines: list[bytes]) -> int:
+    """POST one _bulk request and retry only the items that failed with 429/5xx. Returns the number indexed.
+    A whole-request 429 is retried (nothing was applied). A whole-request 5xx is not: some items may
+    already be indexed under auto-generated IDs, so resending would duplicate them."""
+    url = f"{endpoint.rstrip('/')}/{index_name}/_bulk"
+    headers = {"Content-Type": "application/x-ndjson"}
+
+    indexed = 0
+    for attempt in range(BULK_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(2 ** attempt)
+
+        auth = make_awsauth(region=region, service="aoss")
+        resp = requests.post(url, auth=auth, headers=headers, data=b"".join(lines), timeout=120)
+        if resp.status_code == 429:
+            continue
+        if resp.status_code >= 500:
+            raise SystemExit(
+                f"_bulk request failed: {resp.status_code} {resp.text[:500]}\n"
+                "Some documents in this batch may already be indexed; re-run the script, "
+                "it skips chunk_ids that are already in the index."
+            )
+        if resp.status_code != 200:
+            raise SystemExit(f"_bulk request failed: {resp.status_code} {resp.text}")
+
+        retry = []
+        for line, item in zip(lines, resp.json()["items"]):
+            result = item.get("index", {})
+            status = result.get("status", 0)
+            if status in (200, 201):
+                indexed += 1
+            elif status == 429 or status >= 500:
+                retry.append(line)
+            else:
+                print("Indexing failed for doc:", line.split(b"\n")[1][:200])
+                print("Status:", status)
+                print("Error:", result.get("error"))
+                raise SystemExit("Indexing failed — check the response above.")
+
+        if not retry:
+            return indexed
+        lines = retry
+
+    raise SystemExit(f"_bulk: {len(lines)} documents still failing after {BULK_MAX_RETRIES} retries")
+
+
+def bulk_index_docs(endpoint: str, region: str, index_name: str, docs: list[dict]) -> int:
+    """Index docs through the _bulk endpoint (one SigV4-signed round-trip per batch). Returns the number indexed."""
+    indexed = 0
+    lines = []
+    size = 0
+    for doc in docs:
+        line = BULK_ACTION + json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n"
+        if lines and (len(lines) >= BULK_MAX_DOCS or size + len(line) > BULK_MAX_BYTES):
+            indexed += send_bulk(endpoint, region, index_name, lines)
+            lines = []
+            size = 0
+        lines.append(line)
+        size += len(line)
+
+    if lines:
+        indexed += send_bulk(endpoint, region, index_name, lines)
+    return indexed
 
 
 
 def main():
-    #Load the .env environment variables.
-    load_dotenv()
     endpoint = os.environ.get("OPENSEARCH_END_POINT")
     index_name=os.environ.get("INDEX_NAME")
     input_jsonl=os.environ.get("INPUT_JSONL")
@@ -118,49 +242,66 @@ def main():
 
 
     # Debug: print index URL once
-    print("Index URL:", f"{endpoint.rstrip('/')}/{index_name}/_doc")
+    print("Index URL:", f"{endpoint.rstrip('/')}/{index_name}/_bulk")
+
+    # 0) Load already-indexed chunk_ids once (saves Bedrock embedding cost on re-runs)
+    seen = load_indexed_chunk_ids(endpoint, region, index_name)
+    print(f"Already indexed: {len(seen)} chunks")
 
     total = 0
     success = 0
 
-    for chunk in iter_chunks(str(input_path)):
-        total += 1
+    def flush(pool: ThreadPoolExecutor, batch: list[dict]) -> None:
+        nonlocal success
+
+        # 1) Embed the cache misses concurrently (map keeps input order), and remember them before indexing
+        texts = [c["chunk_text"] for c in batch]
+        embeddings = [cache.get(text) for text in texts]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for i, embedding in zip(misses, pool.map(lambda i: get_bedrock_embedding(texts[i], region=region), misses)):
+            embeddings[i] = embedding
+        cache.put_many([(texts[i], embeddings[i]) for i in misses])
+        print(f"Embeddings: {len(batch) - len(misses)} from cache, {len(misses)} from Bedrock")
+
+        os_docs = []
+        for chunk, embedding in zip(batch, embeddings):
+            # 2) Build OpenSearch doc (field names must match your mapping)
+            os_doc = {
+                "chunk_id": chunk["chunk_id"],
+                "document_id": chunk["document_id"],
+                "page_num": int(chunk["page_num"]),
+                "chunk_text": chunk["chunk_text"],
+                "embedding": embedding,  # must be length EMBED_DIM
+            }
 
-        chunk_id = chunk["chunk_id"]
+            assert len(os_doc["embedding"]) == EMBED_DIM, f"Expected {EMBED_DIM}-dim embedding, got {len(os_doc['embedding'])}"
+            os_docs.append(os_doc)
 
-        # 0) Skip if already indexed (saves Bedrock embedding cost)
-        if chunk_exists(endpoint, region, index_name, chunk_id):
-            print(f"Skip (already indexed): {chunk_id}")
-            continue
+        # 3) Index the batch with one _bulk request
+        success += bulk_index_docs(endpoint, region, index_name, os_docs)
+        print(f"Indexed {success}/{total}: up to {os_docs[-1]['chunk_id']}")
+
+    cache = EmbeddingCache(EMBED_CACHE_PATH)
+    batch = []
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+        for chunk in iter_chunks(str(input_path)):
+            total += 1
+
+            chunk_id = chunk["chunk_id"]
+
+            if chunk_id in seen:
+                print(f"Skip (already indexed): {chunk_id}")
+                continue
+            seen.add(chunk_id)
+
+            batch.append(chunk)
+            if len(batch) >= BULK_MAX_DOCS:
+                flush(pool, batch)
+                batch = []
 
-        # 1) Embed chunk_text
-        embedding = get_bedrock_embedding(chunk["chunk_text"], region=region)
-
-        # 2) Build OpenSearch doc (field names must match your mapping)
-        os_doc = {
-            "chunk_id": chunk_id,
-            "document_id": chunk["document_id"],
-            "page_num": int(chunk["page_num"]),
-            "chunk_text": chunk["chunk_text"],
-            "embedding": embedding,  # must be length 512
-        }
-
-        assert len(os_doc["embedding"]) == 1024, f"Expected 1024-dim embedding, got {len(os_doc['embedding'])}"
-
-        # 3) Index it
-        resp = index_one_doc(endpoint, region, index_name, os_doc)
-
-        if resp.status_code in (200, 201):
-            success += 1
-            print(f"Indexed {success}/{total}: {os_doc['chunk_id']}")
-        else:
-            print("Indexing failed for chunk_id:", os_doc["chunk_id"])
-            print("Status:", resp.status_code)
-            try:
-                print("Body:", resp.json())
-            except Exception:
-                print("Body (raw):", resp.text)
-            raise SystemExit("Indexing failed — check the response above.")
+        if batch:
+            flush(pool, batch)
+    cache.close()
 
     print(f"Done. Indexed {success} documents.")
 
@@ -17,12 +17,14 @@ Optional:
 import json
 import os
 import sys
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
 
 import boto3
 import botocore
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from requests_aws4auth import AWS4Auth
 
 
@@ -49,12 +51,30 @@ def make_awsauth(region: str, service: str = "aoss") -> AWS4Auth:
     )
 
 
+@lru_cache(maxsize=None)
+def http_session() -> requests.Session:
+    """Keep-alive connection pool for OpenSearch, so repeated searches skip the TCP+TLS handshake."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def bedrock_embed(text: str, region: str, model_id: str) -> List[float]:
     """Embed text with Amazon Titan Text Embeddings.
 
     Different Titan embedding models/versions accept slightly different request shapes.
     We try the v2-style shape first, then fall back.
+
+    Results are LRU-cached per (text, region, model_id), so repeated queries in the
+    same process skip the Bedrock round-trip.
     """
+    return list(_bedrock_embed_cached(text.strip(), region, model_id))
+
+
+@lru_cache(maxsize=256)
+def _bedrock_embed_cached(text: str, region: str, model_id: str) -> Tuple[float, ...]:
     client = boto3.client("bedrock-runtime", region_name=region)
 
     # Try Titan Text Embeddings V2 request shape first
@@ -87,12 +107,12 @@ def bedrock_embed(text: str, region: str, model_id: str) -> List[float]:
 
     # Common response: {"embedding": [...]}
     if "embedding" in body and isinstance(body["embedding"], list):
-        return body["embedding"]
+        return tuple(body["embedding"])
 
     # Fallbacks just in case response shape differs
     for k in ("embeddings", "vector"):
         if k in body and isinstance(body[k], list):
-            return body[k]
+            return tuple(body[k])
 
     raise RuntimeError(f"Unexpected Bedrock response keys: {list(body.keys())}")
 
@@ -122,7 +142,7 @@ def opensearch_knn_search(
         },
     }
 
-    r = requests.post(url, auth=awsauth, json=query, timeout=60)
+    r = http_session().post(url, auth=awsauth, json=query, timeout=60)
     if r.status_code >= 300:
         # print raw to help debug 4xx/5xx
         raise RuntimeError(f"OpenSearch error {r.status_code}: {r.text}")
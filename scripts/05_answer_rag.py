@@ -15,18 +15,74 @@ Optional:
 - AWS_REGION=us-east-1
 - BEDROCK_EMBED_MODEL_ID=amazon.titan-embed-text-v2:0
 - BEDROCK_LLM_MODEL_ID=anthropic.claude-3-sonnet-20240229-v1:0
+- EMBED_DIM=1024
+- SENTINEL_CACHE_DIR=~/.cache/sentinel-rag
+- EMBED_CACHE_TTL_S=604800
+- SEMANTIC_CACHE_MIN_SIM=0.95
+- SEMANTIC_CACHE_SIZE=1024
+- SEMANTIC_CACHE_TTL_S=86400
+- OPENSEARCH_REQUEST_CACHE=0
+- CLAUDE_PROMPT_CACHE=0
+- MIN_RETRIEVAL_SCORE=       (unset: always ask Claude)
+
+OPENSEARCH_REQUEST_CACHE=1 adds request_cache=true to the kNN searches, so an
+identical query vector can be answered from the shard request cache. kNN
+queries have size > 0, so on a managed/self-hosted cluster this also needs
+(one-time):
+    PUT _cluster/settings
+    {"persistent": {"indices.requests.cache.maximum_cacheable_size": 256}}
+OpenSearch Serverless manages its own caching, so leave it off there.
+
+EMBED_DIM selects the Titan v2 output size (256, 512 or 1024) and must match
+the index's knn_vector dimension. A 512-dim index halves vector storage, HNSW
+work and request size for most of the recall; build it with the same EMBED_DIM
+in 02_index_chunks_opensearch.py and a mapping like
+    "embedding": {"type": "knn_vector", "dimension": 512,
+                  "method": {"name": "hnsw", "engine": "faiss",
+                             "parameters": {"encoder": {"name": "sq"}}}}
+(the sq encoder additionally stores vectors as 16-bit floats).
+
+Query vectors are L2-normalized before the search, matching the indexed
+vectors (02_index_chunks_opensearch.py embeds with normalize=true). Build the
+index with "space_type": "cosinesimil" (or "innerproduct", which is the same
+ranking for unit vectors, without server-side normalization). With "l2" the
+ranking is still the same for unit vectors, but scores are 1 / (1 + distance).
+
+MIN_RETRIEVAL_SCORE skips Claude and prints the canned "can't find" answer
+when the best kNN score is below it. The score scale depends on the index's
+space_type, so tune it from the chunk scores printed for known out-of-domain
+questions.
+
+CLAUDE_PROMPT_CACHE=1 sends the instructions and CONTEXT as a cached prompt
+prefix (Anthropic prompt caching, e.g. Claude 3.5 Haiku / 3.7 Sonnet and newer
+on Bedrock). Models without it fall back to the plain prompt.
 """
 
-import json
+import argparse
+import asyncio
+import hashlib
+import io
 import os
 import sys
-from typing import Any, Dict, List
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import boto3
 import botocore
+import botocore.auth
+import numpy as np
+import orjson
 import requests
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
 from dotenv import load_dotenv
-from requests_aws4auth import AWS4Auth
+from requests.adapters import HTTPAdapter
 
 
 # ----------------- Utilities -----------------
@@ -38,41 +94,211 @@ def require_env(name: str) -> str:
     return val
 
 
-def make_awsauth(region: str, service: str = "aoss") -> AWS4Auth:
-    """Create SigV4 auth for OpenSearch Serverless (service = aoss)."""
+class SigV4Auth(requests.auth.AuthBase):
+    """
+    requests auth that signs with botocore's SigV4 signer (the one boto3 uses).
+    Only host, content-type and the x-amz-* headers are signed, so headers that
+    requests/urllib3 adjust later can't break the signature. OpenSearch
+    Serverless also requires the signed X-Amz-Content-SHA256 body hash.
+    """
+
+    def __init__(self, credentials, region: str, service: str):
+        self.credentials = credentials
+        self.region = region
+        self.service = service
+
+    def __call__(self, r: requests.PreparedRequest) -> requests.PreparedRequest:
+        body = r.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        headers = {"X-Amz-Content-SHA256": hashlib.sha256(body).hexdigest()}
+        if "Content-Type" in r.headers:
+            headers["Content-Type"] = r.headers["Content-Type"]
+
+        aws_request = AWSRequest(method=r.method, url=r.url, data=body, headers=headers)
+        # get_frozen_credentials refreshes STS/role credentials when they near expiry.
+        botocore.auth.SigV4Auth(self.credentials.get_frozen_credentials(), self.service, self.region).add_auth(aws_request)
+        r.headers.update(aws_request.headers.items())
+        return r
+
+
+@lru_cache(maxsize=4)
+def make_awsauth(region: str, service: str = "aoss") -> SigV4Auth:
+    """
+    Create SigV4 auth for OpenSearch Serverless (service = aoss), once per region.
+    It holds botocore's refreshable credentials rather than a frozen copy, so
+    STS/role credentials are re-fetched when they near expiry instead of the
+    cached signer going stale.
+    """
     session = boto3.Session(region_name=region)
     creds = session.get_credentials()
     if creds is None:
         raise SystemExit("No AWS credentials found. Configure AWS_PROFILE or AWS_ACCESS_KEY_ID/...")
-    frozen = creds.get_frozen_credentials()
-    return AWS4Auth(
-        frozen.access_key,
-        frozen.secret_key,
-        region,
-        service,
-        session_token=frozen.token,
+    return SigV4Auth(creds, region=region, service=service)
+
+
+@lru_cache(maxsize=4)
+def _bedrock(region: str):
+    """Shared bedrock-runtime client, so the embed and Claude calls reuse one connection pool."""
+    return boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(
+            retries={"max_attempts": 3, "mode": "adaptive"},
+            tcp_keepalive=True,
+            max_pool_connections=16,
+        ),
     )
 
 
-def read_query() -> str:
-    if len(sys.argv) >= 2:
-        return " ".join(sys.argv[1:]).strip()
+@lru_cache(maxsize=None)
+def _http_session(region: str) -> requests.Session:
+    """
+    Shared keep-alive session for OpenSearch requests, signed with the cached
+    per-region SigV4 auth.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = make_awsauth(region=region, service="aoss")
+    return session
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """
+    Replace path with data via a uniquely named temp file in the same directory,
+    so concurrent writers (threads or processes) never share a temp file.
+    """
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+
+def cache_root() -> Path:
+    return Path(os.getenv("SENTINEL_CACHE_DIR") or Path.home() / ".cache" / "sentinel-rag")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Answer a question from the indexed documents")
+    parser.add_argument("question", nargs="*", help="Question (read from stdin if omitted)")
+    parser.add_argument(
+        "--ctx-budget",
+        type=int,
+        default=3000,
+        help="Approximate token budget for the CONTEXT sent to Claude (default: 3000)",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=600,
+        help="Approximate token cap for each chunk in the CONTEXT (default: 600)",
+    )
+    return parser.parse_args()
+
+
+def read_query(words: List[str]) -> str:
+    if words:
+        return " ".join(words).strip()
     print("Enter your question:")
     return sys.stdin.readline().strip()
 
 
+def read_queries(words: List[str]) -> List[str]:
+    """
+    Questions to answer: the CLI args as one question, or piped stdin split on
+    blank lines (one question per paragraph). Interactive input stays one line.
+    """
+    if words or sys.stdin.isatty():
+        question = read_query(words)
+        return [question] if question else []
+    paragraphs = "".join(sys.stdin.readlines()).split("\n\n")
+    return [q for q in (" ".join(p.split()) for p in paragraphs) if q]
+
+
 # ----------------- Embeddings (Titan v2) -----------------
 
-def bedrock_embed(text: str, region: str, model_id: str, expected_dim: int = 1024) -> List[float]:
+class QueryEmbedCache:
+    """
+    Content-addressed disk cache of query embeddings: one raw float32 file per
+    sha256(model_id:dim:text), expired by file mtime.
+    """
+
+    def __init__(self, root: Path, ttl_s: float):
+        self.root = root
+        self.ttl_s = ttl_s
+
+    @staticmethod
+    def key(text: str, model_id: str, dim: int) -> str:
+        return hashlib.sha256(f"{model_id}:{dim}:{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self.root / f"{key}.f32"
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - mtime > self.ttl_s:
+            return None
+        return np.fromfile(path, dtype=np.float32)
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{key}.f32"
+        write_atomic(path, np.asarray(vec, dtype=np.float32).tobytes())
+
+
+# Whether each embedding model accepts "dimensions", persisted so a model that
+# rejects it costs one failed call ever, not one per process.
+_capabilities_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def embed_capabilities() -> Dict[str, bool]:
+    try:
+        return orjson.loads((cache_root() / "capabilities.json").read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+
+def record_embed_capability(model_id: str, supports_dimensions: bool) -> None:
+    with _capabilities_lock:
+        capabilities = embed_capabilities()
+        capabilities[model_id] = supports_dimensions
+        root = cache_root()
+        root.mkdir(parents=True, exist_ok=True)
+        write_atomic(root / "capabilities.json", orjson.dumps(capabilities))
+
+
+# Where the vector lives in an embedding response, in the order they are tried.
+EMBEDDING_RESPONSE_KEYS = ("embedding", "vector", "embeddings")
+
+
+def bedrock_embed(
+    text: str,
+    region: str,
+    model_id: str,
+    expected_dim: int = 1024,
+    cache: Optional[QueryEmbedCache] = None,
+) -> np.ndarray:
     """
-    Embed text with Titan Text Embeddings v2.
-    Your index mapping expects 1024 dims (based on your last fixes).
+    Embed text with Titan Text Embeddings v2, returned as a unit-length float32 vector.
+    expected_dim must match the index mapping (EMBED_DIM, 1024 by default).
+    With a cache, repeat questions are served from disk without calling Bedrock.
     """
-    client = boto3.client("bedrock-runtime", region_name=region)
+    if cache is not None:
+        key = cache.key(text, model_id, expected_dim)
+        cached = cache.get(key)
+        if cached is not None and len(cached) == expected_dim:
+            return cached
+
+    client = _bedrock(region)
 
+    # Titan v2 takes the output size as "dimensions" (256, 512 or 1024).
     payload_v2 = {
         "inputText": text,
-        "embeddingConfig": {"outputEmbeddingLength": expected_dim},
+        "dimensions": expected_dim,
     }
     payload_simple = {"inputText": text}
 
@@ -81,50 +307,86 @@ def bedrock_embed(text: str, region: str, model_id: str, expected_dim: int = 102
             modelId=model_id,
             contentType="application/json",
             accept="application/json",
-            body=json.dumps(payload),
+            body=orjson.dumps(payload),
         )
-        return json.loads(resp["body"].read())
-
-    try:
-        body = _invoke(payload_v2)
-    except botocore.exceptions.ClientError as e:
-        msg = str(e)
-        # if model rejects embeddingConfig/outputEmbeddingLength, retry simple
-        if "extraneous key" in msg or "embeddingConfig" in msg or "outputEmbeddingLength" in msg:
-            body = _invoke(payload_simple)
-        else:
-            raise
-
-    if "embedding" in body and isinstance(body["embedding"], list):
-        vec = body["embedding"]
-    elif "vector" in body and isinstance(body["vector"], list):
-        vec = body["vector"]
-    elif "embeddings" in body and isinstance(body["embeddings"], list):
-        vec = body["embeddings"]
+        # Parsed straight from the raw bytes; they are only decoded for the error message.
+        data = resp["body"].read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise RuntimeError(f"Bedrock returned invalid JSON ({e}): {data[:200]!r}") from None
+
+    if not embed_capabilities().get(model_id, True):
+        body = _invoke(payload_simple)
+    else:
+        try:
+            body = _invoke(payload_v2)
+        except botocore.exceptions.ClientError as e:
+            error = e.response.get("Error", {})
+            # Only a model that doesn't know the dimensions key is retried simple (the dimension
+            # check below still applies) and remembered. Other errors, e.g. an invalid
+            # dimensions value, are raised and never recorded.
+            if error.get("Code") == "ValidationException" and "extraneous key [dimensions]" in error.get("Message", ""):
+                record_embed_capability(model_id, False)
+                body = _invoke(payload_simple)
+            else:
+                raise
+
+    for field in EMBEDDING_RESPONSE_KEYS:
+        vec = body.get(field)
+        if isinstance(vec, list):
+            break
     else:
         raise RuntimeError(f"Unexpected Bedrock response keys: {list(body.keys())}")
 
-    if len(vec) != expected_dim:
-        raise SystemExit(f"Query embedding dimension {len(vec)} != {expected_dim} (mapping expects {expected_dim})")
+    vec = np.asarray(vec, dtype=np.float32)
+    if vec.shape != (expected_dim,):
+        raise SystemExit(f"Query embedding shape {vec.shape} != ({expected_dim},) (mapping expects {expected_dim})")
 
-    return vec
+    # Unit length (also for models/payloads that don't normalize), so the vector is
+    # cached, searched and compared in the semantic cache without re-normalizing.
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    if cache is not None:
+        cache.put(key, vec)
 
+    return vec
 
-# ----------------- Retrieval (OpenSearch kNN) -----------------
 
-def opensearch_knn_search(
-    endpoint: str,
-    index: str,
+def bedrock_embed_batch(
+    texts: List[str],
     region: str,
-    query_vector: List[float],
-    k: int = 5,
-) -> Dict[str, Any]:
-    url = f"{endpoint.rstrip('/')}/{index}/_search"
-    awsauth = make_awsauth(region=region, service="aoss")
+    model_id: str,
+    expected_dim: int = 1024,
+    cache: Optional[QueryEmbedCache] = None,
+    max_in_flight: int = 6,
+) -> List[np.ndarray]:
+    """
+    Embed several texts with up to max_in_flight concurrent Titan calls (Titan v2 takes
+    one inputText per request). Repeated texts are embedded once. Results keep input
+    order; throttling is absorbed by the client's adaptive retries.
+    """
+    unique = list(dict.fromkeys(texts))
+    if len(unique) <= 1:
+        vecs = [bedrock_embed(t, region, model_id, expected_dim, cache) for t in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            vecs = list(pool.map(lambda t: bedrock_embed(t, region, model_id, expected_dim, cache), unique))
+    by_text = dict(zip(unique, vecs))
+    return [by_text[t] for t in texts]
 
-    query = {
+
+# ----------------- Retrieval (OpenSearch kNN) -----------------
+
+def knn_query(query_vector: np.ndarray, k: int = 5) -> Dict[str, Any]:
+    return {
+        # Only the requested fields come back; the stored _source (and its
+        # embedding) is not returned. chunk_text is a text field, so OpenSearch
+        # still reads it from _source on the server side.
         "size": k,
-        "_source": ["chunk_id", "document_id", "page_num", "chunk_text"],
+        "_source": False,
+        "fields": ["chunk_id", "document_id", "page_num", "chunk_text"],
         "query": {
             "knn": {
                 "embedding": {
@@ -135,74 +397,363 @@ def opensearch_knn_search(
         },
     }
 
-    r = requests.post(url, auth=awsauth, json=query, timeout=60)
+
+def opensearch_msearch(
+    endpoint: str,
+    index: str,
+    region: str,
+    bodies: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Run several searches in one signed _msearch round-trip (newline-delimited
+    header/body pairs). Returns one search response per body, in order.
+    """
+    url = f"{endpoint.rstrip('/')}/{index}/_msearch"
+
+    header = {"request_cache": True} if os.getenv("OPENSEARCH_REQUEST_CACHE", "0") == "1" else {}
+    header_line = orjson.dumps(header) + b"\n"
+    # orjson writes the float32 arrays straight to JSON, no Python float list in between.
+    payload = b"".join(
+        header_line + orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n" for body in bodies
+    )
+
+    r = _http_session(region).post(
+        url,
+        data=payload,
+        headers={"Content-Type": "application/x-ndjson"},
+        timeout=60,
+    )
     if r.status_code >= 300:
         raise RuntimeError(f"OpenSearch error {r.status_code}: {r.text}")
-    return r.json()
+
+    responses = orjson.loads(r.content)["responses"]
+    for res in responses:
+        if "error" in res:
+            raise RuntimeError(f"OpenSearch error {res.get('status')}: {res['error']}")
+    return responses
+
+
+def opensearch_knn_search(
+    endpoint: str,
+    index: str,
+    region: str,
+    query_vector: np.ndarray,
+    k: int = 5,
+) -> Dict[str, Any]:
+    return opensearch_msearch(endpoint, index, region, [knn_query(query_vector, k)])[0]
+
+
+def hit_fields(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a hit's `fields` (every value comes back as a list) into a chunk dict, keeping its _score."""
+    chunk = {name: values[0] if len(values) == 1 else values for name, values in hit.get("fields", {}).items()}
+    chunk["_score"] = hit.get("_score")
+    return chunk
+
+
+def warm_opensearch(endpoint: str, index: str, region: str) -> None:
+    """Sign and open the pooled OpenSearch connection (TCP + TLS) ahead of the kNN search. Best effort."""
+    try:
+        _http_session(region).head(f"{endpoint.rstrip('/')}/{index}", timeout=10)
+    except requests.RequestException:
+        # opensearch_knn_search reports real connectivity errors.
+        pass
+
+
+# ----------------- Semantic cache -----------------
+
+class SemanticCache:
+    """
+    Recent (query vector, retrieved chunks) pairs, persisted under root as one
+    (N, dim) float32 matrix plus a parallel entries file. Vectors are normalized
+    once at insert, so M @ q is the cosine similarity; a paraphrased question
+    with similarity >= min_sim reuses the cached chunks and skips OpenSearch.
+    """
+
+    def __init__(self, root: Path, min_sim: float, capacity: int, ttl_s: float):
+        self.root = root
+        self.min_sim = min_sim
+        self.capacity = capacity
+        self.ttl_s = ttl_s
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+    def load(self) -> None:
+        try:
+            vectors = np.load(self.root / "vectors.npy")
+            entries = orjson.loads((self.root / "entries.json").read_bytes())
+        except (FileNotFoundError, ValueError):
+            return
+        if len(vectors) != len(entries):
+            return
+
+        now = time.time()
+        keep = [i for i, e in enumerate(entries) if now - e["stored_at"] <= self.ttl_s]
+        self.vectors = vectors[keep]
+        self.entries = [entries[i] for i in keep]
+
+    def save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        buf = io.BytesIO()
+        np.save(buf, self.vectors)
+        write_atomic(self.root / "vectors.npy", buf.getvalue())
+        write_atomic(self.root / "entries.json", orjson.dumps(self.entries))
+
+    @staticmethod
+    def _normalize(vec: np.ndarray) -> np.ndarray:
+        q = np.asarray(vec, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        return q / norm if norm > 0 else q
+
+    def lookup(self, qvec: np.ndarray, index: str, k: int) -> Optional[List[Dict[str, Any]]]:
+        # bedrock_embed already returns unit vectors.
+        q = np.asarray(qvec, dtype=np.float32)
+        if not self.entries or self.vectors.shape[1] != q.size:
+            return None
+
+        sims = self.vectors @ q
+        for i, e in enumerate(self.entries):
+            if e["index"] != index or e["k"] != k:
+                sims[i] = -np.inf
+        j = int(np.argmax(sims))
+        if sims[j] < self.min_sim:
+            return None
+
+        self.entries[j]["last_used"] = time.time()
+        print(f"(semantic cache hit, similarity {sims[j]:.4f})")
+        return self.entries[j]["chunks"]
+
+    def put(self, qvec: np.ndarray, index: str, k: int, chunks: List[Dict[str, Any]]) -> None:
+        q = self._normalize(qvec)
+        if self.vectors.shape[1] != q.size:
+            # Embedding dimension changed: the old vectors can't be compared any more.
+            self.vectors = np.zeros((0, q.size), dtype=np.float32)
+            self.entries = []
+
+        if len(self.entries) >= self.capacity:
+            # Evict the least recently used entry.
+            j = min(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"])
+            self.vectors = np.delete(self.vectors, j, axis=0)
+            del self.entries[j]
+
+        now = time.time()
+        self.vectors = np.vstack([self.vectors, q[None, :]])
+        self.entries.append({"index": index, "k": k, "stored_at": now, "last_used": now, "chunks": chunks})
 
 
 # ----------------- Generation (Claude Sonnet) -----------------
 
-def claude_answer(question: str, chunks: List[Dict[str, Any]], region: str, model_id: str) -> str:
+# Answers are only cached while generation is deterministic.
+CLAUDE_TEMPERATURE = 0
+
+# Canned answer when the context doesn't cover the question.
+NO_ANSWER = "I can’t find that in the provided document."
+
+# Answering instructions; the prompt-caching path sends them as the system prompt.
+CLAUDE_INSTRUCTIONS = f"""You are a helpful assistant.
+Answer the QUESTION using ONLY the CONTEXT below.
+If the answer is not in the context, say exactly:
+{NO_ANSWER}
+
+Return your answer as bullet points.
+After EACH bullet, add citations in this exact format: (p.<page>, <chunk_id>)"""
+
+# Plain (non-cached) prompt: the same instructions, then CONTEXT and QUESTION, with no indentation.
+PROMPT_TEMPLATE = CLAUDE_INSTRUCTIONS + """
+
+CONTEXT:
+{context}
+
+QUESTION:
+{question}
+
+ANSWER:
+"""
+
+# Cleared the first time the model rejects cache_control, so later questions skip the retry.
+_prompt_cache_supported = True
+
+
+@dataclass(slots=True)
+class Chunk:
+    """A retrieved chunk with its prompt fields checked once."""
+    page_num: Any
+    chunk_id: str
+    chunk_text: str
+
+    @classmethod
+    def from_dict(cls, c: Dict[str, Any]) -> "Chunk":
+        return cls(c.get("page_num"), c.get("chunk_id"), (c.get("chunk_text") or "").strip())
+
+
+def pack_context(chunks: List[Dict[str, Any]], budget_tokens: int, chunk_tokens: int) -> List[Dict[str, Any]]:
     """
-    Uses Claude Sonnet on Bedrock to answer using retrieved context.
+    Highest-scoring chunks first, each truncated to chunk_tokens, until budget_tokens
+    is used up (tokens estimated as len(text) // 4); the chunk that crosses the
+    budget is truncated to fit.
+    """
+    ranked = sorted(chunks, key=lambda c: c.get("_score") or 0.0, reverse=True)
+    packed = []
+    used = 0
+    for c in ranked:
+        room = min(budget_tokens - used, chunk_tokens)
+        if room <= 0:
+            break
+        text = c.get("chunk_text") or ""
+        tokens = len(text) // 4
+        if tokens > room:
+            c = {**c, "chunk_text": text[: room * 4]}
+            tokens = room
+        packed.append(c)
+        used += tokens
+    return packed
+
+
+class AnswerCache:
+    """
+    Disk cache of Claude answers, one {key}.txt per
+    sha256(model_id|normalized question|sorted chunk_ids and their texts).
+    The texts are part of the key because pack_context may truncate a chunk,
+    so the same chunk_ids can reach Claude with different context.
     """
-    client = boto3.client("bedrock-runtime", region_name=region)
 
-    # Keep context compact to avoid huge prompts
-    context_lines = []
-    for c in chunks:
-        page = c.get("page_num")
-        chunk_id = c.get("chunk_id")
-        text = (c.get("chunk_text") or "").strip()
-        context_lines.append(f"[page={page} chunk_id={chunk_id}]\n{text}")
+    def __init__(self, root: Path):
+        self.root = root
 
-    context = "\n\n---\n\n".join(context_lines)
+    @staticmethod
+    def key(question: str, chunks: List[Dict[str, Any]], model_id: str) -> str:
+        h = hashlib.sha256(f"{model_id}|{question.strip().lower()}".encode("utf-8"))
+        for c in sorted(chunks, key=lambda c: str(c.get("chunk_id"))):
+            h.update(f"|{c.get('chunk_id')}\0{c.get('chunk_text') or ''}".encode("utf-8"))
+        return h.hexdigest()
 
-    prompt = f"""
-                You are a helpful assistant.
-                Answer the QUESTION using ONLY the CONTEXT below.
-                If the answer is not in the context, say exactly:
-                I can’t find that in the provided document.
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return (self.root / f"{key}.txt").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
 
-                Return your answer as bullet points.
-                After EACH bullet, add citations in this exact format: (p.<page>, <chunk_id>)
+    def put(self, key: str, answer: str) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{key}.txt"
+        write_atomic(path, answer.encode("utf-8"))
 
-                CONTEXT:
-                {context}
 
-                QUESTION:
-                {question}
+def _invoke_with_prompt_cache(client, model_id: str, question: str, context: str) -> Optional[Dict[str, Any]]:
+    """
+    Stream an answer with Anthropic prompt caching: the instructions go in `system`
+    and a cache_control breakpoint after CONTEXT caches that whole prefix, so a
+    follow-up over the same chunks only pays prefill for the question. Returns None
+    if the model doesn't support prompt caching.
+    """
+    global _prompt_cache_supported
 
-                ANSWER:
-                """
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 500,
+        "temperature": CLAUDE_TEMPERATURE,
+        "system": [{"type": "text", "text": CLAUDE_INSTRUCTIONS}],
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": f"CONTEXT:\n{context}", "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": f"QUESTION:\n{question}\n\nANSWER:"},
+                ],
+            }
+        ],
+    }
+
+    try:
+        return client.invoke_model_with_response_stream(
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=orjson.dumps(body),
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ValidationException":
+            raise
+        print(f"(prompt caching not available for {model_id}, using the plain prompt)")
+        _prompt_cache_supported = False
+        return None
+
+
+def claude_answer(
+    question: str,
+    chunks: List[Dict[str, Any]],
+    region: str,
+    model_id: str,
+    echo: bool = False,
+    cache: Optional[AnswerCache] = None,
+) -> str:
+    """
+    Uses Claude Sonnet on Bedrock to answer using retrieved context.
+    The answer is streamed; with echo=True tokens are printed as they arrive.
+    With a cache, a repeat question over the same chunks skips Claude entirely.
+    """
+    if cache is not None and CLAUDE_TEMPERATURE != 0:
+        cache = None
+    if cache is not None:
+        key = cache.key(question, chunks, model_id)
+        cached = cache.get(key)
+        if cached is not None:
+            if echo:
+                print(cached)
+            return cached
+
+    client = _bedrock(region)
+
+    # Keep context compact to avoid huge prompts
+    context = "\n\n---\n\n".join(
+        f"[page={c.page_num} chunk_id={c.chunk_id}]\n{c.chunk_text}" for c in map(Chunk.from_dict, chunks)
+    )
+    prompt = PROMPT_TEMPLATE.format(context=context, question=question)
 
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 500,
-        "temperature": 0,
+        "temperature": CLAUDE_TEMPERATURE,
         "messages": [
             {"role": "user", "content": prompt}
         ],
     }
 
-    resp = client.invoke_model(
-        modelId=model_id,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body),
-    )
+    resp = None
+    if _prompt_cache_supported and os.getenv("CLAUDE_PROMPT_CACHE", "0") == "1":
+        resp = _invoke_with_prompt_cache(client, model_id, question, context)
+    if resp is None:
+        resp = client.invoke_model_with_response_stream(
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=orjson.dumps(body),
+        )
 
-    out = json.loads(resp["body"].read())
+    # Streamed events: {"type":"content_block_delta","delta":{"type":"text_delta","text":"..."}}
+    parts = []
+    for event in resp["body"]:
+        chunk = orjson.loads(event["chunk"]["bytes"])
+        if chunk["type"] == "content_block_delta":
+            text = chunk["delta"].get("text")
+            if text:
+                if echo:
+                    print(text, end="", flush=True)
+                parts.append(text)
+    if echo:
+        print()
 
-    # Claude responses: {"content":[{"type":"text","text":"..."}], ...}
-    return out["content"][0]["text"]
+    answer = "".join(parts)
+    if cache is not None and answer:
+        cache.put(key, answer)
+
+    return answer
 
 
 # ----------------- Main -----------------
 
-def main() -> None:
+async def main() -> None:
     load_dotenv()
+    args = parse_args()
 
     endpoint = require_env("OPENSEARCH_END_POINT")
     index = require_env("INDEX_NAME")
@@ -211,36 +762,80 @@ def main() -> None:
 
     embed_model_id = os.getenv("BEDROCK_EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
     llm_model_id = os.getenv("BEDROCK_LLM_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+    embed_dim = int(os.getenv("EMBED_DIM", "1024"))
+    min_score = float(os.environ["MIN_RETRIEVAL_SCORE"]) if os.getenv("MIN_RETRIEVAL_SCORE") else None
 
-    question = read_query()
-    if not question:
+    questions = read_queries(args.question)
+    if not questions:
         raise SystemExit("Empty question")
 
-    print(f"\nQuestion: {question}")
-
-    print("\n1) Embedding question...")
-    qvec = bedrock_embed(question, region=region, model_id=embed_model_id, expected_dim=1024)
-
-    print("2) Retrieving top chunks from OpenSearch...")
-    res = opensearch_knn_search(endpoint, index, region, qvec, k=5)
+    embed_cache = QueryEmbedCache(
+        cache_root() / "embeds",
+        ttl_s=float(os.getenv("EMBED_CACHE_TTL_S", str(7 * 24 * 3600))),
+    )
 
-    hits = res.get("hits", {}).get("hits", [])
-    chunks = [h.get("_source", {}) for h in hits]
+    loop = asyncio.get_running_loop()
 
-    print("\nTop chunks:")
-    for i, c in enumerate(chunks, 1):
-        preview = (c.get("chunk_text") or "").replace("\n", " ")
-        if len(preview) > 160:
-            preview = preview[:160] + "..."
-        print(f"{i}. page={c.get('page_num')} chunk_id={c.get('chunk_id')}  -> {preview}")
+    print("\n1) Embedding " + ("question..." if len(questions) == 1 else f"{len(questions)} questions..."))
+    # The OpenSearch connection is opened while the embedding calls are in flight.
+    qvecs, _ = await asyncio.gather(
+        loop.run_in_executor(
+            None,
+            lambda: bedrock_embed_batch(questions, region=region, model_id=embed_model_id, expected_dim=embed_dim, cache=embed_cache),
+        ),
+        loop.run_in_executor(None, warm_opensearch, endpoint, index, region),
+    )
 
-    print("\n3) Asking Claude Sonnet...")
-    answer = claude_answer(question, chunks, region=region, model_id=llm_model_id)
+    semantic_cache = SemanticCache(
+        cache_root() / "semantic",
+        min_sim=float(os.getenv("SEMANTIC_CACHE_MIN_SIM", "0.95")),
+        capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", "1024")),
+        ttl_s=float(os.getenv("SEMANTIC_CACHE_TTL_S", str(24 * 3600))),
+    )
+    semantic_cache.load()
+    answer_cache = AnswerCache(cache_root() / "answers")
 
-    print("\n================= ANSWER =================\n")
-    print(answer)
-    print("\n=========================================\n")
+    print("2) Retrieving top chunks from OpenSearch...")
+    # Questions the semantic cache can't answer are searched together in one _msearch.
+    retrieved = [semantic_cache.lookup(qvec, index, k=5) for qvec in qvecs]
+    misses = [i for i, chunks in enumerate(retrieved) if chunks is None]
+    if misses:
+        results = await loop.run_in_executor(
+            None, opensearch_msearch, endpoint, index, region, [knn_query(qvecs[i], 5) for i in misses]
+        )
+        for i, res in zip(misses, results):
+            hits = res.get("hits", {}).get("hits", [])
+            retrieved[i] = [hit_fields(h) for h in hits]
+            semantic_cache.put(qvecs[i], index, 5, retrieved[i])
+    semantic_cache.save()
+
+    for question, chunks in zip(questions, retrieved):
+        print(f"\nQuestion: {question}")
+
+        print("\nTop chunks:")
+        for i, c in enumerate(chunks, 1):
+            preview = (c.get("chunk_text") or "").replace("\n", " ")
+            if len(preview) > 160:
+                preview = preview[:160] + "..."
+            print(f"{i}. score={c.get('_score')} page={c.get('page_num')} chunk_id={c.get('chunk_id')}  -> {preview}")
+
+        # Below the score threshold the answer would be NO_ANSWER anyway, so Claude is skipped.
+        scores = [c["_score"] for c in chunks if c.get("_score") is not None]
+        if min_score is not None and (not chunks or (scores and max(scores) < min_score)):
+            top = f"{max(scores):.4f}" if scores else "n/a"
+            print(f"\n3) Top score {top} < MIN_RETRIEVAL_SCORE={min_score}, not asking Claude")
+            print("\n================= ANSWER =================\n")
+            print(NO_ANSWER)
+            print("\n=========================================\n")
+            continue
+
+        chunks = pack_context(chunks, args.ctx_budget, args.chunk_tokens)
+
+        print("\n3) Asking Claude Sonnet...")
+        print("\n================= ANSWER =================\n")
+        claude_answer(question, chunks, region=region, model_id=llm_model_id, echo=True, cache=answer_cache)
+        print("\n=========================================\n")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file